@@ -3,7 +3,9 @@ import os
 import io
 import sys
 import json
+import ast
 from pathlib import Path
+from functools import lru_cache
 
 # --- Load environment variables from .env file ---
 from dotenv import load_dotenv
@@ -11,12 +13,19 @@ from dotenv import load_dotenv
 load_dotenv()
 print("Attempting to load environment variables from .env file...")
 
+import orjson
 import pandas as pd
-import vertexai
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from google.adk.agents import LlmAgent
 from google.adk.tools import FunctionTool, ToolContext
 from pydantic import BaseModel, Field
 
+try:
+    import numba  # Optional: JIT-compiles numeric kernels supplied by the model.
+except ImportError:
+    numba = None
+
 # --- Configuration & Initialization ---
 warnings.filterwarnings("ignore")
 import logging
@@ -27,28 +36,150 @@ print("Loading data analytics agent (Definitive Final Version)...")
 # --- Path Configuration ---
 PROJECT_ROOT = Path.cwd().parent
 CSV_PATH = PROJECT_ROOT / "data" / "raw" / "data.csv"
+PARQUET_PATH = CSV_PATH.with_suffix(".parquet")
 
 if not CSV_PATH.exists():
     sys.exit(f"FATAL ERROR: CSV file not found at the expected path: {CSV_PATH}")
 else:
     print(f"Successfully found data file at: {CSV_PATH}")
 
+# --- Shared Agent Code ---
+# Helpers shared by all agents live in src/agent_common, outside agents/, so that `adk web`
+# does not list them as an agent.
+_SRC_DIR = str(Path(__file__).resolve().parents[2] / "src")
+if _SRC_DIR not in sys.path:
+    sys.path.insert(0, _SRC_DIR)
+from agent_common.bootstrap import init_vertex
+from agent_common.isolation import WorkerPool
+
 # --- Initialize Vertex AI ---
-try:
-    resolved_project = os.getenv("GOOGLE_CLOUD_PROJECT")
-    resolved_location = os.getenv("GOOGLE_CLOUD_LOCATION")
-    if not resolved_project or not resolved_location:
-        sys.exit(
-            "FATAL ERROR: GOOGLE_CLOUD_PROJECT and GOOGLE_CLOUD_LOCATION must be set in your .env file."
+# Shared across agents: loading several agents in one process initializes Vertex AI only once.
+init_vertex()
+
+# --- Compact dtypes ---
+# Numbers are narrowed only in the Parquet copy. Generated code always runs on int64, float64
+# and object columns, because arithmetic on narrowed columns silently overflows or loses precision.
+def _downcast(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrinks numeric columns to the narrowest dtype that stores their values without loss."""
+    for col in df.select_dtypes("integer").columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    for col in df.select_dtypes("floating").columns:
+        narrow = pd.to_numeric(df[col], downcast="float")
+        # Only keep float32 when every value survives the round-trip unchanged.
+        if ((narrow.astype(df[col].dtype) == df[col]) | df[col].isna()).all():
+            df[col] = narrow
+    return df
+
+
+def _widen(df: pd.DataFrame) -> pd.DataFrame:
+    """Restores the dtypes pd.read_csv would give a frame read back from the compact Parquet copy."""
+    for col in df.select_dtypes("integer").columns:
+        df[col] = df[col].astype("int64")
+    for col in df.select_dtypes("floating").columns:
+        df[col] = df[col].astype("float64")
+    for col in df.select_dtypes("category").columns:
+        # Parquet copies written by earlier versions stored text as categoricals.
+        df[col] = df[col].astype(df[col].cat.categories.dtype)
+    return df
+
+
+# --- Parquet Storage ---
+# Remembers the CSV mtime of a failed conversion so it is not retried on every tool call.
+_PARQUET_FAILED_MTIME = {"value": None}
+
+
+CSV_BLOCK_SIZE = 8 << 20  # bytes handed to each Arrow parser thread
+
+
+def _read_csv_full() -> pd.DataFrame:
+    """Parses the whole CSV with Arrow's multithreaded reader, falling back to pandas if Arrow rejects the file."""
+    read_options = pacsv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_SIZE)
+    try:
+        # Arrow infers dates and times from the first block; pd.read_csv keeps them as text, and
+        # so does this, so that code such as df['Hired'].str[:4] behaves as it always has.
+        with pacsv.open_csv(CSV_PATH, read_options=read_options) as reader:
+            text_columns = {
+                field.name: pa.string() for field in reader.schema if pa.types.is_temporal(field.type)
+            }
+        table = pacsv.read_csv(
+            CSV_PATH,
+            read_options=read_options,
+            # Empty text cells become missing values, as with pd.read_csv, not "".
+            convert_options=pacsv.ConvertOptions(
+                column_types=text_columns, strings_can_be_null=True
+            ),
         )
-    vertexai.init(
-        project=resolved_project, location=resolved_location, api_transport="rest"
-    )
-    print(
-        f"Vertex AI initialized for project '{resolved_project}' in location '{resolved_location}'."
-    )
-except Exception as e:
-    sys.exit(f"Error initializing Vertex AI: {e}")
+        return table.to_pandas()
+    except pa.ArrowInvalid as e:
+        print(f"Warning: Arrow could not parse the CSV, using pandas instead: {e}")
+        return pd.read_csv(CSV_PATH, low_memory=False)
+
+
+def _refresh_parquet() -> bool:
+    """
+    (Re)builds the Parquet copy of the CSV when it is missing or older than the CSV.
+    Returns False if the CSV cannot be converted, in which case callers read the CSV directly.
+    """
+    csv_mtime = CSV_PATH.stat().st_mtime
+    if _PARQUET_FAILED_MTIME["value"] == csv_mtime:
+        return False
+    try:
+        if PARQUET_PATH.exists() and PARQUET_PATH.stat().st_mtime >= csv_mtime:
+            return True
+        tmp_path = PARQUET_PATH.with_suffix(".parquet.tmp")
+        _downcast(_read_csv_full()).to_parquet(
+            tmp_path, engine="pyarrow", compression="zstd", index=False
+        )
+        os.replace(tmp_path, PARQUET_PATH)
+        print(f"Converted {CSV_PATH.name} to Parquet at: {PARQUET_PATH}")
+        return True
+    except Exception as e:
+        print(f"Warning: could not convert CSV to Parquet, falling back to CSV: {e}")
+        _PARQUET_FAILED_MTIME["value"] = csv_mtime
+        return False
+
+
+_refresh_parquet()
+
+# --- DataFrame Cache ---
+# Keyed on (path, mtime) so the data is loaded once and re-read only when the file changes.
+_DF_CACHE = {}
+
+
+def _get_df() -> pd.DataFrame:
+    """Returns the cached DataFrame, reloading it if the underlying file has been modified."""
+    source = PARQUET_PATH if _refresh_parquet() else CSV_PATH
+    key = (source, source.stat().st_mtime)
+    if key not in _DF_CACHE:
+        _DF_CACHE.clear()
+        if source == PARQUET_PATH:
+            _DF_CACHE[key] = _widen(pd.read_parquet(PARQUET_PATH, engine="pyarrow"))
+        else:
+            _DF_CACHE[key] = _read_csv_full()
+    return _DF_CACHE[key]
+
+
+# --- Schema Cache ---
+# The schema rarely changes, so it is formatted once and rebuilt only when the CSV changes.
+_SCHEMA_CACHE = {"mtime": None, "value": None}
+
+
+def _build_schema_info() -> str:
+    """Formats the row count and column dtypes of the DataFrame that generated code runs on."""
+    df = _get_df()
+    return f"The dataframe has {len(df)} rows and the following columns (with their data types):\n{str(df.dtypes.to_dict())}"
+
+
+def _get_schema_info() -> str:
+    """Returns the cached schema description, rebuilding it if the CSV has been modified."""
+    mtime = CSV_PATH.stat().st_mtime_ns
+    if _SCHEMA_CACHE["mtime"] != mtime:
+        _SCHEMA_CACHE["value"] = _build_schema_info()
+        _SCHEMA_CACHE["mtime"] = mtime
+    return _SCHEMA_CACHE["value"]
+
+
+_get_schema_info()
 
 
 # --- Tool Definitions ---
@@ -58,35 +189,260 @@ def inspect_csv_schema(tool_context: ToolContext) -> str:
     """
     print(f"  [Tool Call] inspect_csv_schema triggered.")
     try:
-        df = pd.read_csv(CSV_PATH, low_memory=False)
-        return f"The dataframe has {len(df)} rows and the following columns (with their data types):\n{str(df.dtypes.to_dict())}"
+        return _get_schema_info()
     except Exception as e:
         return f'{{"error": "Failed to inspect CSV schema: {e}"}}'
 
 
+# --- Result Serialization ---
+# Larger results are truncated: the model only needs a preview to answer.
+MAX_RESULT_ROWS = 1000
+
+
+def _dumps(payload) -> str:
+    """Encodes a payload with orjson, handling NumPy values natively and anything else via str()."""
+    # OPT_NON_STR_KEYS: e.g. value_counts().to_dict() on a numeric column has numeric keys.
+    return orjson.dumps(
+        payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS, default=str
+    ).decode()
+
+
+def _result_to_json(query_result) -> str:
+    """Serializes the value assigned to `result` by generated code."""
+    if isinstance(query_result, (pd.DataFrame, pd.Series)):
+        head = query_result.head(MAX_RESULT_ROWS)
+        if isinstance(head, pd.DataFrame):
+            payload = head.to_dict(orient="records")
+        else:
+            payload = head.tolist()
+        if len(query_result) > MAX_RESULT_ROWS:
+            payload = {"records": payload, "truncated": True, "total_rows": len(query_result)}
+        return _dumps(payload)
+    elif query_result is not None:
+        return _dumps({"result": query_result})
+    else:
+        return _dumps({"result": "Query executed, but no result was assigned."})
+
+
+# --- Numba Kernels ---
+def _call_numba_fn(numba_fn, df: pd.DataFrame, columns: list) -> object:
+    """
+    Calls the model-supplied `numba_fn` with the requested columns as NumPy arrays.
+    The function is compiled with numba.njit when numba is installed; if it cannot be
+    compiled, the plain Python function is used instead. Nothing is cached: each query
+    defines a new function object, so a compiled kernel would never be reused.
+    """
+    arrays = [df[col].to_numpy() for col in columns]
+    if numba is None:
+        return numba_fn(*arrays)
+    try:
+        return numba.njit(numba_fn)(*arrays)  # njit compiles lazily on the first call
+    except Exception:
+        return numba_fn(*arrays)
+
+
+# --- Vectorized Filter Fast Path ---
+class _ColumnRefRewriter(ast.NodeTransformer):
+    """Replaces `df['col']` / `df.col` with placeholders that are later rendered as backtick-quoted column names."""
+
+    def __init__(self):
+        self.columns = []
+
+    def _placeholder(self, column: str) -> ast.Name:
+        self.columns.append(column)
+        return ast.Name(id=f"__col{len(self.columns) - 1}__", ctx=ast.Load())
+
+    def visit_Subscript(self, node):
+        if (
+            isinstance(node.value, ast.Name)
+            and node.value.id == "df"
+            and isinstance(node.slice, ast.Constant)
+            and isinstance(node.slice.value, str)
+        ):
+            return self._placeholder(node.slice.value)
+        return self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if (
+            isinstance(node.value, ast.Name)
+            and node.value.id == "df"
+            and not hasattr(pd.DataFrame, node.attr)  # df.loc, df.shape, ... are not columns
+        ):
+            return self._placeholder(node.attr)
+        return self.generic_visit(node)
+
+
+@lru_cache(maxsize=256)
+def _plan_filter_query(query_code: str) -> tuple | None:
+    """
+    Recognizes `result = df[<mask>]` and `result = len(df[<mask>])` and translates the mask into
+    a DataFrame.eval expression. Returns (kind, expression), or None if the code does not match.
+    """
+    try:
+        tree = ast.parse(query_code)
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Assign):
+        return None
+    stmt = tree.body[0]
+    if [getattr(t, "id", None) for t in stmt.targets] != ["result"]:
+        return None
+
+    value, kind = stmt.value, "rows"
+    if (
+        isinstance(value, ast.Call)
+        and isinstance(value.func, ast.Name)
+        and value.func.id == "len"
+        and len(value.args) == 1
+        and not value.keywords
+    ):
+        value, kind = value.args[0], "count"
+    if not (
+        isinstance(value, ast.Subscript)
+        and isinstance(value.value, ast.Name)
+        and value.value.id == "df"
+        and isinstance(value.slice, (ast.Compare, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Call))
+    ):
+        return None
+
+    rewriter = _ColumnRefRewriter()
+    mask = rewriter.visit(value.slice)
+    if any(isinstance(node, ast.Name) and node.id == "df" for node in ast.walk(mask)):
+        return None  # other uses of df (e.g. df.loc) are not expressible in DataFrame.eval
+    if any("`" in column for column in rewriter.columns):
+        return None
+    expression = ast.unparse(mask)
+    for i, column in enumerate(rewriter.columns):
+        expression = expression.replace(f"__col{i}__", f"`{column}`")
+    return kind, expression
+
+
+def _try_fast_filter(query_code: str, df: pd.DataFrame) -> object:
+    """Evaluates simple filter queries with numexpr. Returns None when the code must run through exec()."""
+    plan = _plan_filter_query(query_code)
+    if plan is None:
+        return None
+    kind, expression = plan
+    try:
+        mask = df.eval(expression, engine="numexpr")
+    except Exception:
+        return None
+    if not (isinstance(mask, pd.Series) and mask.dtype == bool and mask.index.equals(df.index)):
+        return None
+    return int(mask.sum()) if kind == "count" else df[mask]
+
+
+@lru_cache(maxsize=256)
+def _compile_query(query_code: str):
+    """Compiles generated code once per distinct source text."""
+    return compile(query_code, "<query_code>", "exec")
+
+
+# --- Isolated Code Execution ---
+# Generated code runs in worker processes: a crash cannot take the agent down and
+# concurrent queries are not serialized by the GIL. Each worker loads the DataFrame once,
+# when it starts, so nothing is re-parsed per call.
+EXEC_WORKERS = 4
+EXEC_TIMEOUT_SECONDS = 30
+
+
+def _init_worker() -> None:
+    """Makes sure each worker holds the DataFrame before its first task."""
+    _get_df()
+
+
+_WORKERS = WorkerPool(EXEC_WORKERS, EXEC_TIMEOUT_SECONDS, initializer=_init_worker)
+
+
+def _execute_query(query_code: str) -> str:
+    """Executes pandas code against the cached DataFrame. Runs inside a worker process."""
+    # Shallow copy: generated code can add/drop columns without touching the cached frame.
+    df = _get_df().copy(deep=False)
+    fast_result = _try_fast_filter(query_code, df)
+    if fast_result is not None:
+        return _result_to_json(fast_result)
+
+    local_vars = {"pd": pd, "df": df}
+    exec(_compile_query(query_code), globals(), local_vars)
+    numba_fn = local_vars.get("numba_fn")
+    if callable(numba_fn):
+        local_vars["result"] = _call_numba_fn(
+            numba_fn, df, local_vars.get("numba_columns", [])
+        )
+    return _result_to_json(local_vars.get("result"))
+
+
+@lru_cache(maxsize=256)
+def _run_pandas(query_code: str, data_mtime_ns: int) -> str:
+    """Executes pandas code in a worker and caches its JSON result. The CSV mtime is part of the key, so results expire when the file changes."""
+    return _WORKERS.run(_execute_query, query_code)
+
+
 def execute_pandas_query(query_code: str) -> str:
     """
     Executes a string of Python pandas code to query the data. The pandas DataFrame is available as `df`. The code MUST assign its result to a variable named `result`.
     """
     print(f"  [Tool Call] execute_pandas_query with code:\n---\n{query_code}\n---")
     try:
-        df = pd.read_csv(CSV_PATH, low_memory=False)
-        local_vars = {"pd": pd, "df": df}
-        exec(query_code, globals(), local_vars)
-        query_result = local_vars.get("result")
-
-        if isinstance(query_result, (pd.DataFrame, pd.Series)):
-            return query_result.to_json(orient="records")
-        elif query_result is not None:
-            return json.dumps({"result": query_result})
-        else:
-            return json.dumps({"result": "Query executed, but no result was assigned."})
+        return _run_pandas(query_code.strip(), CSV_PATH.stat().st_mtime_ns)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+
+# --- Chunked Execution ---
+# Files below this size are served from the in-memory cache; larger ones are streamed in chunks.
+CHUNKED_READ_THRESHOLD_BYTES = 100 * 1024 * 1024
+CHUNK_ROWS = 1_000_000
+
+
+def _filter_frame(frame: pd.DataFrame, filter_code: str) -> pd.DataFrame:
+    """Evaluates a boolean expression over `df` and returns the matching rows."""
+    mask = eval(filter_code, globals(), {"pd": pd, "df": frame})
+    return frame[mask]
+
+
+def _execute_chunked(filter_code: str, agg_code: str) -> str:
+    """Filters the data chunk by chunk, then runs `agg_code` on the concatenated matches. Runs inside a worker process."""
+    if CSV_PATH.stat().st_size < CHUNKED_READ_THRESHOLD_BYTES:
+        filtered = _filter_frame(_get_df().copy(deep=False), filter_code)
+    else:
+        parts = [
+            _filter_frame(chunk, filter_code)
+            for chunk in pd.read_csv(CSV_PATH, chunksize=CHUNK_ROWS, low_memory=True)
+        ]
+        filtered = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+    if not agg_code:
+        return _result_to_json(filtered)
+    local_vars = {"pd": pd, "df": filtered}
+    exec(agg_code, globals(), local_vars)
+    return _result_to_json(local_vars.get("result"))
+
+
+@lru_cache(maxsize=256)
+def _run_pandas_chunked(filter_code: str, agg_code: str, data_mtime_ns: int) -> str:
+    """Runs a chunked query in a worker and caches its JSON result."""
+    return _WORKERS.run(_execute_chunked, filter_code, agg_code)
+
+
+def execute_pandas_query_chunked(filter_code: str, agg_code: str = "") -> str:
+    """
+    Memory-safe variant of execute_pandas_query for large files. `filter_code` is a boolean pandas expression over `df` (e.g. "df['Country'] == 'France'") applied to each chunk of the file. `agg_code` is optional code run on the filtered rows (available as `df`) that MUST assign its answer to `result`; without it the filtered rows are returned.
+    """
+    print(
+        f"  [Tool Call] execute_pandas_query_chunked with filter:\n---\n{filter_code}\n---\nand aggregation:\n---\n{agg_code}\n---"
+    )
+    try:
+        return _run_pandas_chunked(
+            filter_code.strip(), agg_code.strip(), CSV_PATH.stat().st_mtime_ns
+        )
     except Exception as e:
         return json.dumps({"error": str(e)})
 
 
 schema_inspector_tool = FunctionTool(func=inspect_csv_schema)
 query_executor_tool = FunctionTool(func=execute_pandas_query)
+chunked_query_executor_tool = FunctionTool(func=execute_pandas_query_chunked)
 
 root_agent = LlmAgent(
     name="CsvAnalyticsAssistant",
@@ -94,6 +450,7 @@ root_agent = LlmAgent(
     tools=[
         schema_inspector_tool,
         query_executor_tool,
+        chunked_query_executor_tool,
     ],
     instruction="""You are an expert Data Analytics AI. Your purpose is to answer user questions about a dataset by inspecting its schema, writing Python pandas code, executing it, and summarizing the result. You must be methodical and follow the process perfectly.
 
@@ -107,6 +464,8 @@ root_agent = LlmAgent(
         - The code you generate must use the column names from the schema.
         - The code MUST assign its final answer to a variable named `result`.
         - The code must NOT use `print()`.
+        - If the schema shows a very large dataset (millions of rows) and the question is "filter, then count/aggregate", call `execute_pandas_query_chunked` instead, with `filter_code` as a boolean expression over `df` (e.g. `"df['Country'] == 'France'"`) and optional `agg_code` that assigns `result` from the filtered `df` (e.g. `"result = len(df)"`).
+        - For heavy numeric loops that pandas cannot vectorize, you may instead define a function `numba_fn` that takes NumPy arrays and uses plain loops, and set `numba_columns` to the list of columns to pass to it (in order). The tool compiles it with Numba, calls it, and uses its return value as `result`. Example: `def numba_fn(salary):\n    total = 0.0\n    for v in salary:\n        if v > 50000:\n            total += v\n    return total\nnumba_columns = ['Salary']`
 
     4.  **FINAL RESPONSE (THIRD ACTION):** After receiving the JSON data from `execute_pandas_query`, your final response MUST be a single, user-friendly natural language sentence summarizing the result. Do not output code or raw JSON in your final answer.
 
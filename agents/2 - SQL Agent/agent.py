@@ -3,8 +3,10 @@ import os
 import io
 import sys
 import json
+import asyncio
 import sqlite3
 from pathlib import Path
+from functools import lru_cache
 
 # --- Load environment variables from .env file ---
 from dotenv import load_dotenv
@@ -12,8 +14,8 @@ from dotenv import load_dotenv
 load_dotenv()
 print("Attempting to load environment variables from .env file...")
 
+import orjson
 import pandas as pd
-import vertexai
 from google.adk.agents import LlmAgent
 from google.adk.tools import FunctionTool, ToolContext
 from pydantic import BaseModel, Field
@@ -34,22 +36,56 @@ if not DB_PATH.exists():
 else:
     print(f"Successfully found database file at: {DB_PATH}")
 
+# --- Shared Agent Code ---
+# Helpers shared by all agents live in src/agent_common, outside agents/, so that `adk web`
+# does not list them as an agent.
+_SRC_DIR = str(Path(__file__).resolve().parents[2] / "src")
+if _SRC_DIR not in sys.path:
+    sys.path.insert(0, _SRC_DIR)
+from agent_common.bootstrap import init_vertex
+from agent_common.database import get_conn, query_to_json
+
 # --- Initialize Vertex AI ---
-try:
-    resolved_project = os.getenv("GOOGLE_CLOUD_PROJECT")
-    resolved_location = os.getenv("GOOGLE_CLOUD_LOCATION")
-    if not resolved_project or not resolved_location:
-        sys.exit(
-            "FATAL ERROR: GOOGLE_CLOUD_PROJECT and GOOGLE_CLOUD_LOCATION must be set in your .env file."
+# Shared across agents: loading several agents in one process initializes Vertex AI only once.
+init_vertex()
+
+# --- Schema Cache ---
+# The schema rarely changes, so it is formatted once and rebuilt only when the database file changes.
+_SCHEMA_CACHE = {"mtime": None, "value": None}
+
+
+def _build_schema_info() -> str:
+    """Formats the list of tables and their columns."""
+    cursor = get_conn(DB_PATH).cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
+    tables = cursor.fetchall()
+    if not tables:
+        return "No tables found in the database."
+    schema_info = "The database contains the following tables:\n"
+    for table_name_tuple in tables:
+        table_name = table_name_tuple[0]
+        schema_info += f"- Table '{table_name}' with columns: "
+        cursor.execute(f"PRAGMA table_info('{table_name}');")
+        columns = cursor.fetchall()
+        column_names = [col[1] for col in columns]
+        schema_info += f"({', '.join(column_names)})\n"
+    if any(table_name.startswith("_agg_") for (table_name,) in tables):
+        schema_info += (
+            "Tables prefixed '_agg_' are precomputed summaries of analytics_data: one row per value with its row count in column 'n'. Query them instead of re-running GROUP BY ... COUNT(*).\n"
         )
-    vertexai.init(
-        project=resolved_project, location=resolved_location, api_transport="rest"
-    )
-    print(
-        f"Vertex AI initialized for project '{resolved_project}' in location '{resolved_location}'."
-    )
-except Exception as e:
-    sys.exit(f"Error initializing Vertex AI: {e}")
+    return schema_info
+
+
+def _get_schema_info() -> str:
+    """Returns the cached schema description, rebuilding it if the database has been modified."""
+    mtime = DB_PATH.stat().st_mtime_ns
+    if _SCHEMA_CACHE["mtime"] != mtime:
+        _SCHEMA_CACHE["value"] = _build_schema_info()
+        _SCHEMA_CACHE["mtime"] = mtime
+    return _SCHEMA_CACHE["value"]
+
+
+_get_schema_info()
 
 
 # --- Tool Definitions for SQLite ---
@@ -59,44 +95,65 @@ def inspect_db_schema(tool_context: ToolContext) -> str:
     """
     print("  [Tool Call] inspect_db_schema triggered.")
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        if not tables:
-            return "No tables found in the database."
-        schema_info = "The database contains the following tables:\n"
-        for table_name_tuple in tables:
-            table_name = table_name_tuple[0]
-            schema_info += f"- Table '{table_name}' with columns: "
-            cursor.execute(f"PRAGMA table_info('{table_name}');")
-            columns = cursor.fetchall()
-            column_names = [col[1] for col in columns]
-            schema_info += f"({', '.join(column_names)})\n"
-        conn.close()
-        return schema_info
+        return _get_schema_info()
     except Exception as e:
         return f'{{"error": "Failed to inspect database schema: {e}"}}'
 
 
-def execute_sql_query(sql_query: str) -> str:
+# --- Result Serialization ---
+# Larger results are truncated: the model only needs a preview to answer.
+MAX_RESULT_ROWS = 1000
+
+
+def _frame_to_json(result_df: pd.DataFrame) -> str:
+    """Serializes a result table as JSON records with orjson, keeping at most MAX_RESULT_ROWS rows."""
+    payload = result_df.head(MAX_RESULT_ROWS).to_dict(orient="records")
+    if len(result_df) > MAX_RESULT_ROWS:
+        payload = {"records": payload, "truncated": True, "total_rows": len(result_df)}
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY, default=str).decode()
+
+
+def _scalar_to_json(column: str, value) -> str:
+    """Serializes a single-value result in the same layout as _frame_to_json."""
+    return orjson.dumps([{column: value}], default=str).decode()
+
+
+@lru_cache(maxsize=256)
+def _run_sql(sql_query: str, db_mtime_ns: int) -> str:
+    """Runs a query and caches its JSON result. The database mtime is part of the key, so results expire when the file changes."""
+    return query_to_json(DB_PATH, sql_query, _frame_to_json, _scalar_to_json)
+
+
+def _execute_sql(sql_query: str) -> str:
+    """Runs one query through the result cache, reporting failures as a JSON error."""
+    try:
+        return _run_sql(sql_query.strip(), DB_PATH.stat().st_mtime_ns)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+
+async def execute_sql_query(sql_query: str) -> str:
     """
     Use this tool to execute a valid SQLite query against the database. Returns the query result as a JSON string.
     """
     print(f"  [Tool Call] execute_sql_query with query:\n---\n{sql_query}\n---")
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        result_df = pd.read_sql_query(sql_query, conn)
-        conn.close()
-        return result_df.to_json(orient="records")
-    except Exception as e:
-        return json.dumps({"error": str(e)})
+    return await asyncio.to_thread(_execute_sql, sql_query)
+
+
+async def execute_sql_batch(sql_queries: list[str]) -> str:
+    """Executes several independent SQLite queries concurrently. Returns a JSON list with one result per query, in the same order. Prefer this over repeated execute_sql_query calls when the queries do not depend on each other."""
+    print(f"  [Tool Call] execute_sql_batch with {len(sql_queries)} queries.")
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_execute_sql, sql_query) for sql_query in sql_queries)
+    )
+    return "[" + ",".join(results) + "]"
 
 
 # --- Final Agent Definition ---
 
 schema_inspector_tool = FunctionTool(func=inspect_db_schema)
 query_executor_tool = FunctionTool(func=execute_sql_query)
+batch_executor_tool = FunctionTool(func=execute_sql_batch)
 
 root_agent = LlmAgent(
     name="SqlAnalyticsAssistant",
@@ -104,6 +161,7 @@ root_agent = LlmAgent(
     tools=[
         schema_inspector_tool,
         query_executor_tool,
+        batch_executor_tool,
     ],
     instruction="""You are an expert SQL Database Analyst. Your purpose is to answer user questions by inspecting a database schema, writing SQLite queries, executing them, and summarizing the result. You must be methodical and follow the process perfectly.
 
@@ -116,6 +174,7 @@ root_agent = LlmAgent(
     3.  **SQL GENERATION & EXECUTION (SECOND ACTION):** After you have the schema from the previous step, your next action MUST be to call the `execute_sql_query` tool. To do this, you must generate the SQL code for its `sql_query` argument.
         - The SQL you generate must use the table and column names from the schema.
         - The SQL must be valid for SQLite.
+        - If answering the question needs several independent queries, call `execute_sql_batch` once with all of them (`sql_queries=[...]`) instead of calling `execute_sql_query` repeatedly; it returns a JSON list of results in the same order.
 
     4.  **FINAL RESPONSE (THIRD ACTION):** After receiving the JSON data from `execute_sql_query`, your final response MUST be a single, user-friendly natural language answer. Do not output SQL or raw JSON in your final answer.
         - If the JSON result contains an 'error' key, explain the error politely.
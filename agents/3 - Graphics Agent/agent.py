@@ -3,8 +3,9 @@ import os
 import io
 import sys
 import json
-import sqlite3
+import uuid
 from pathlib import Path
+from functools import lru_cache
 import datetime
 
 # --- Load environment variables from .env file ---
@@ -12,8 +13,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+import orjson
 import pandas as pd
-import vertexai
 from google.adk.agents import LlmAgent
 from google.adk.tools import FunctionTool, ToolContext
 
@@ -23,7 +24,10 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
-import base64
+
+# Plotly renders simple bar/count/line charts faster than Matplotlib (PNG export via kaleido)
+import plotly.express as px
+import plotly.io as pio
 
 # --- Configuration & Initialization ---
 warnings.filterwarnings("ignore")
@@ -45,20 +49,57 @@ if not DB_PATH.exists():
 else:
     print(f"Successfully found database file at: {DB_PATH}")
 
+# --- Shared Agent Code ---
+# Helpers shared by all agents live in src/agent_common, outside agents/, so that `adk web`
+# does not list them as an agent.
+_SRC_DIR = str(Path(__file__).resolve().parents[2] / "src")
+if _SRC_DIR not in sys.path:
+    sys.path.insert(0, _SRC_DIR)
+from agent_common.bootstrap import init_vertex
+from agent_common.database import get_conn, query_to_json, read_sql_frame
+from agent_common.figures import close_other_figures, shared_figure
+from agent_common.isolation import WorkerPool
+
 # --- Initialize Vertex AI ---
-try:
-    resolved_project = os.getenv("GOOGLE_CLOUD_PROJECT")
-    resolved_location = os.getenv("GOOGLE_CLOUD_LOCATION")
-    if not resolved_project or not resolved_location:
-        sys.exit("FATAL ERROR: GCP Project and Location must be set in your .env file.")
-    vertexai.init(
-        project=resolved_project, location=resolved_location, api_transport="rest"
-    )
-    print(
-        f"Vertex AI initialized for project '{resolved_project}' in location '{resolved_location}'."
-    )
-except Exception as e:
-    sys.exit(f"Error initializing Vertex AI: {e}")
+# Shared across agents: loading several agents in one process initializes Vertex AI only once.
+init_vertex()
+
+# --- Schema Cache ---
+# The schema rarely changes, so it is formatted once and rebuilt only when the database file changes.
+_SCHEMA_CACHE = {"mtime": None, "value": None}
+
+
+def _build_schema_info() -> str:
+    """Formats the list of tables and their columns."""
+    cursor = get_conn(DB_PATH).cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
+    tables = cursor.fetchall()
+    if not tables:
+        return "No tables found in the database."
+    schema_info = "The database contains the following tables:\n"
+    for table_name_tuple in tables:
+        table_name = table_name_tuple[0]
+        schema_info += f"- Table '{table_name}' with columns: "
+        cursor.execute(f"PRAGMA table_info('{table_name}');")
+        columns = [col[1] for col in cursor.fetchall()]
+        schema_info += f"({', '.join(columns)})\n"
+    if any(table_name.startswith("_agg_") for (table_name,) in tables):
+        schema_info += (
+            "Tables prefixed '_agg_' are precomputed summaries of analytics_data: one row per value with its row count in column 'n'. Query them instead of re-running GROUP BY ... COUNT(*).\n"
+        )
+    return schema_info
+
+
+def _get_schema_info() -> str:
+    """Returns the cached schema description, rebuilding it if the database has been modified."""
+    mtime = DB_PATH.stat().st_mtime_ns
+    if _SCHEMA_CACHE["mtime"] != mtime:
+        _SCHEMA_CACHE["value"] = _build_schema_info()
+        _SCHEMA_CACHE["mtime"] = mtime
+    return _SCHEMA_CACHE["value"]
+
+
+_get_schema_info()
 
 
 # --- Tool Definitions ---
@@ -66,71 +107,103 @@ def inspect_db_schema(tool_context: ToolContext) -> str:
     """Use this tool FIRST to understand the database schema, including all table names and their columns, before writing any query or plotting code."""
     print("  [Tool Call] inspect_db_schema triggered.")
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        if not tables:
-            return "No tables found in the database."
-        schema_info = "The database contains the following tables:\n"
-        for table_name_tuple in tables:
-            table_name = table_name_tuple[0]
-            schema_info += f"- Table '{table_name}' with columns: "
-            cursor.execute(f"PRAGMA table_info('{table_name}');")
-            columns = [col[1] for col in cursor.fetchall()]
-            schema_info += f"({', '.join(columns)})\n"
-        conn.close()
-        return schema_info
+        return _get_schema_info()
     except Exception as e:
         return f'{{"error": "Failed to inspect schema: {e}"}}'
 
 
+# --- Result Serialization ---
+# Larger results are truncated: the model only needs a preview to answer.
+MAX_RESULT_ROWS = 1000
+
+
+def _frame_to_json(result_df: pd.DataFrame) -> str:
+    """Serializes a result table as JSON records with orjson, keeping at most MAX_RESULT_ROWS rows."""
+    payload = result_df.head(MAX_RESULT_ROWS).to_dict(orient="records")
+    if len(result_df) > MAX_RESULT_ROWS:
+        payload = {"records": payload, "truncated": True, "total_rows": len(result_df)}
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY, default=str).decode()
+
+
+def _scalar_to_json(column: str, value) -> str:
+    """Serializes a single-value result in the same layout as _frame_to_json."""
+    return orjson.dumps([{column: value}], default=str).decode()
+
+
+@lru_cache(maxsize=256)
+def _run_sql(sql_query: str, db_mtime_ns: int) -> str:
+    """Runs a query and caches its JSON result. The database mtime is part of the key, so results expire when the file changes."""
+    return query_to_json(DB_PATH, sql_query, _frame_to_json, _scalar_to_json)
+
+
 def execute_sql_query(sql_query: str) -> str:
     """Use this tool to execute a SQLite query to get data for a simple text-based answer."""
     print(f"  [Tool Call] execute_sql_query with query:\n---\n{sql_query}\n---")
     try:
-        conn = sqlite3.connect(DB_PATH)
-        result_df = pd.read_sql_query(sql_query, conn)
-        conn.close()
-        return result_df.to_json(orient="records")
+        return _run_sql(sql_query.strip(), DB_PATH.stat().st_mtime_ns)
     except Exception as e:
         return json.dumps({"error": str(e)})
 
 
-def execute_plotting_code(python_code: str) -> str:
-    """Executes Python code to generate a plot, saves it to the logs folder, and returns a JSON object with the file path."""
-    print(f"  [Tool Call] execute_plotting_code with code:\n---\n{python_code}\n---")
+# --- Isolated Code Execution ---
+# Generated plotting code runs in worker processes, so a crash or a leaked figure
+# cannot take the agent down and concurrent plots are not serialized by the GIL.
+EXEC_WORKERS = 4
+EXEC_TIMEOUT_SECONDS = 60
+_WORKERS = WorkerPool(EXEC_WORKERS, EXEC_TIMEOUT_SECONDS)
+
+
+def _plot_data_query(columns: list[str] | None, sql: str | None) -> str:
+    """Builds the query that loads a plot's data, projecting only the columns it needs."""
+    if sql:
+        return sql
+    if columns:
+        quoted = ", ".join('"' + col.replace('"', '""') + '"' for col in columns)
+        return f"SELECT {quoted} FROM analytics_data"
+    return "SELECT * FROM analytics_data"
+
+
+def _render_plot(python_code: str, data_query: str, output_path: str) -> None:
+    """Loads the plot data and runs the plotting code. Runs inside a worker process."""
+    execution_scope = {
+        "pd": pd,
+        "df": read_sql_frame(DB_PATH, data_query),
+        "plt": plt,
+        "mpl_fig": shared_figure(),
+        "sns": sns,
+        "px": px,
+        "pio": pio,
+        "io": io,
+        "output_path": output_path,
+    }
+
+    # The plotting code writes the PNG straight to output_path (no base64 round-trip).
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT * FROM analytics_data", conn)
-        conn.close()
-
-        execution_scope = {
-            "pd": pd,
-            "df": df,
-            "plt": plt,
-            "sns": sns,
-            "io": io,
-            "base64": base64,
-        }
-
         exec(python_code, execution_scope)
-        b64_image = execution_scope.get("result")
+    finally:
+        close_other_figures()
 
-        if isinstance(b64_image, str):
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_path = LOGS_DIR / f"plot_{timestamp}.png"
-            with open(file_path, "wb") as f:
-                f.write(base64.b64decode(b64_image))
-            print(f"Image successfully saved to {file_path}")
 
-            return json.dumps(
-                {"status": "success", "file_path": str(file_path.resolve())}
-            )
-        else:
+def execute_plotting_code(
+    python_code: str, columns: list[str] | None = None, sql: str | None = None
+) -> str:
+    """Executes Python code to generate a plot, saves it to the logs folder, and returns a JSON object with the file path. Pass `columns` (or a `sql` query) so that `df` only holds the data the plot needs."""
+    print(f"  [Tool Call] execute_plotting_code with code:\n---\n{python_code}\n---")
+    try:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Unique per call: concurrent plots in the same second must not share (or vouch for) a file.
+        file_path = LOGS_DIR / f"plot_{timestamp}_{uuid.uuid4().hex[:8]}.png"
+
+        _WORKERS.run(
+            _render_plot, python_code, _plot_data_query(columns, sql), str(file_path)
+        )
+
+        if not file_path.exists():
             raise ValueError(
-                "Plotting code did not assign a valid base64 string to the 'result' variable."
+                "Plotting code did not save the chart to the path in `output_path`."
             )
+        print(f"Image successfully saved to {file_path}")
+        return json.dumps({"status": "success", "file_path": str(file_path.resolve())})
     except Exception as e:
         return json.dumps({"error": str(e)})
 
@@ -162,15 +235,17 @@ root_agent = LlmAgent(
         a. **Generate Plotting Code:** Call `execute_plotting_code`. The `python_code` argument must be a script that generates a plot.
             - **CRITICAL RULE: DO NOT WRITE `import` STATEMENTS.** The necessary libraries are pre-loaded.
             - The data is in a pandas DataFrame named `df`.
-            - The code MUST assign the final base64-encoded PNG image string to a variable named `result`.
-            - **AESTHETICS:** Use `sns.set_theme(style='whitegrid')` and a professional `palette` like `'viridis'` or `'mako'`. Ensure labels are legible and use `plt.tight_layout()`.
+            - **Always pass `columns`** with the exact list of columns your code uses (e.g. `columns=['Country']`), so only that data is loaded into `df`. For pre-aggregated data, pass a SQLite `sql` query instead; `df` will hold its result.
+            - The code MUST save the final PNG image to the pre-defined variable `output_path`. Do not encode the image or choose your own path.
+            - **PREFER PLOTLY:** For bar, count, line and pie charts use Plotly Express (`px`), e.g. `fig = px.bar(...); fig.write_image(output_path, width=1200, height=800)`. Use `template='plotly_white'` and ensure labels are legible.
+            - Fall back to Matplotlib/Seaborn (`plt`, `sns`) only for charts Plotly Express cannot produce; draw on the pre-created figure `mpl_fig` (do not call `plt.figure()` or `plt.close()`): `ax = mpl_fig.add_subplot(111)`, pass `ax=ax` to Seaborn, use `sns.set_theme(style='whitegrid')` and a professional `palette` like `'viridis'` or `'mako'`, then finish with `mpl_fig.tight_layout(); mpl_fig.savefig(output_path, dpi=120, bbox_inches='tight')`.
         b. **FINAL RESPONSE:** The `execute_plotting_code` tool will return a JSON object like `{"status": "success", "file_path": "C:\\path\\to\\plot.png"}`. Your final response MUST be a clear message informing the user of success and providing them with the full file path.
 
     **EXAMPLE OF A PERFECT VISUALIZATION FLOW:**
 
     * **USER:** "Show me a bar chart of employees per Country."
     * **AGENT's 1st ACTION (Tool Call):** `inspect_db_schema()`
-    * **AGENT's 2nd ACTION (Tool Call):** `execute_plotting_code(python_code="sns.set_theme(style='whitegrid'); plt.figure(figsize=(12, 8)); sns.countplot(data=df, y='Country', order=df['Country'].value_counts().index, palette='viridis'); ... result = base64.b64encode(buffer.getvalue()).decode('utf-8'); plt.close();")`
+    * **AGENT's 2nd ACTION (Tool Call):** `execute_plotting_code(columns=['Country'], python_code="counts = df['Country'].value_counts().reset_index(); fig = px.bar(counts, x='count', y='Country', orientation='h', template='plotly_white', title='Employees per Country'); fig.write_image(output_path, width=1200, height=800)")`
     * **AGENT's FINAL ANSWER (Text):** "Success! I have generated the chart you requested. It has been saved to your computer at the following location: C:\\Users\\YourUser\\YourProject\\agents\\data_self_analytics__basic_reporting_v3\\logs\\plot_20250618_143000.png"
     """,
 )
\ No newline at end of file
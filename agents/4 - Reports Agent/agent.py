@@ -5,8 +5,10 @@ import os
 import io
 import sys
 import json
-import sqlite3
+import asyncio
+import threading
 from pathlib import Path
+from functools import lru_cache
 import datetime
 
 # --- Load environment variables from .env file ---
@@ -14,9 +16,10 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+import orjson
 import pandas as pd
-import vertexai
 from google.adk.agents import LlmAgent
+from google.adk.agents.readonly_context import ReadonlyContext
 from google.adk.tools import FunctionTool, ToolContext
 
 # Matplotlib setup
@@ -25,7 +28,10 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
-import base64
+
+# Plotly renders simple bar/count/line charts faster than Matplotlib (PNG export via kaleido)
+import plotly.express as px
+import plotly.io as pio
 
 # --- Configuration & Initialization ---
 warnings.filterwarnings("ignore")
@@ -45,18 +51,20 @@ print(f"Reports will be saved in: {REPORTS_DIR}")
 if not DB_PATH.exists():
     sys.exit(f"FATAL ERROR: Database file not found at: {DB_PATH}")
 
+# --- Shared Agent Code ---
+# Helpers shared by all agents live in src/agent_common, outside agents/, so that `adk web`
+# does not list them as an agent.
+_SRC_DIR = str(Path(__file__).resolve().parents[2] / "src")
+if _SRC_DIR not in sys.path:
+    sys.path.insert(0, _SRC_DIR)
+from agent_common.bootstrap import init_vertex
+from agent_common.database import get_conn, query_to_json, read_sql_frame
+from agent_common.figures import close_other_figures, shared_figure
+from agent_common.isolation import WorkerPool
+
 # --- Initialize Vertex AI ---
-try:
-    resolved_project = os.getenv("GOOGLE_CLOUD_PROJECT")
-    resolved_location = os.getenv("GOOGLE_CLOUD_LOCATION")
-    if not resolved_project or not resolved_location:
-        sys.exit("FATAL ERROR: GCP Project and Location must be set in .env file.")
-    vertexai.init(
-        project=resolved_project, location=resolved_location, api_transport="rest"
-    )
-    print(f"Vertex AI initialized for project '{resolved_project}'.")
-except Exception as e:
-    sys.exit(f"Error initializing Vertex AI: {e}")
+# Shared across agents: loading several agents in one process initializes Vertex AI only once.
+init_vertex()
 
 # --- V4 Tool Definitions ---
 def create_report_folder(tool_context: ToolContext) -> str:
@@ -74,38 +82,106 @@ def create_report_folder(tool_context: ToolContext) -> str:
         return json.dumps({"error": f"Failed to create report folder: {e}"})
 
 
-def execute_sql_query(sql_query: str) -> str:
-    """Executes a SQLite query to retrieve data for the report."""
-    print(f"  [Tool Call] execute_sql_query with query:\n---\n{sql_query}\n---")
+# --- Result Serialization ---
+# Larger results are truncated: the report only needs a preview of each table.
+MAX_RESULT_ROWS = 1000
+
+
+def _frame_to_json(result_df: pd.DataFrame) -> str:
+    """Serializes a result table in pandas' "split" layout with orjson, keeping at most MAX_RESULT_ROWS rows."""
+    payload = result_df.head(MAX_RESULT_ROWS).to_dict(orient="split")
+    if len(result_df) > MAX_RESULT_ROWS:
+        payload.update(truncated=True, total_rows=len(result_df))
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY, default=str).decode()
+
+
+def _scalar_to_json(column: str, value) -> str:
+    """Serializes a single-value result in the same layout as _frame_to_json."""
+    return orjson.dumps({"index": [0], "columns": [column], "data": [[value]]}, default=str).decode()
+
+
+# Also deduplicates tool calls: an identical query, from either SQL tool, is answered from here.
+@lru_cache(maxsize=256)
+def _run_sql(sql_query: str, db_mtime_ns: int) -> str:
+    """Runs a query and caches its JSON result. The database mtime is part of the key, so results expire when the file changes."""
+    return query_to_json(DB_PATH, sql_query, _frame_to_json, _scalar_to_json)
+
+
+def _execute_sql(sql_query: str) -> str:
+    """Runs one query through the result cache, reporting failures as a JSON error."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        result_df = pd.read_sql_query(sql_query, conn)
-        conn.close()
-        return result_df.to_json(orient="split")
+        return _run_sql(sql_query.strip(), DB_PATH.stat().st_mtime_ns)
     except Exception as e:
         return json.dumps({"error": str(e)})
 
 
-def execute_plotting_code(python_code: str, report_folder_path: str) -> str:
-    """Executes Python code to generate a plot and saves it into the specified report folder."""
+async def execute_sql_query(sql_query: str) -> str:
+    """Executes a SQLite query to retrieve data for the report."""
+    print(f"  [Tool Call] execute_sql_query with query:\n---\n{sql_query}\n---")
+    return await asyncio.to_thread(_execute_sql, sql_query)
+
+
+async def execute_sql_batch(sql_queries: list[str]) -> str:
+    """Executes several independent SQLite queries concurrently. Returns a JSON list with one result per query, in the same order. Prefer this over repeated execute_sql_query calls when the queries do not depend on each other."""
+    print(f"  [Tool Call] execute_sql_batch with {len(sql_queries)} queries.")
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_execute_sql, sql_query) for sql_query in sql_queries)
+    )
+    return "[" + ",".join(results) + "]"
+
+
+# --- Isolated Code Execution ---
+# Generated plotting code runs in worker processes, so a crash or a leaked figure
+# cannot take the agent down and concurrent plots are not serialized by the GIL.
+EXEC_WORKERS = 4
+EXEC_TIMEOUT_SECONDS = 60
+_WORKERS = WorkerPool(EXEC_WORKERS, EXEC_TIMEOUT_SECONDS)
+
+
+def _plot_data_query(columns: list[str] | None, sql: str | None) -> str:
+    """Builds the query that loads a plot's data, projecting only the columns it needs."""
+    if sql:
+        return sql
+    if columns:
+        quoted = ", ".join('"' + col.replace('"', '""') + '"' for col in columns)
+        return f"SELECT {quoted} FROM analytics_data"
+    return "SELECT * FROM analytics_data"
+
+
+def _render_plot(python_code: str, data_query: str, report_folder_path: str) -> None:
+    """Loads the plot data and runs the plotting code. Runs inside a worker process."""
+    execution_scope = {
+        "pd": pd,
+        "df": read_sql_frame(DB_PATH, data_query),
+        "plt": plt,
+        "mpl_fig": shared_figure(),
+        "sns": sns,
+        "px": px,
+        "pio": pio,
+        "io": io,
+        "report_folder_path": report_folder_path,
+    }
+
+    try:
+        exec(python_code, execution_scope)
+    finally:
+        close_other_figures()
+
+
+def execute_plotting_code(
+    python_code: str,
+    report_folder_path: str,
+    columns: list[str] | None = None,
+    sql: str | None = None,
+) -> str:
+    """Executes Python code to generate a plot and saves it into the specified report folder. Pass `columns` (or a `sql` query) so that `df` only holds the data the plot needs."""
     print(
         f"  [Tool Call] execute_plotting_code triggered for folder: {report_folder_path}"
     )
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT * FROM analytics_data", conn)
-        conn.close()
-
-        execution_scope = {
-            "pd": pd,
-            "df": df,
-            "plt": plt,
-            "sns": sns,
-            "io": io,
-            "base64": base64,
-        }
-
-        exec(python_code, execution_scope)
+        _WORKERS.run(
+            _render_plot, python_code, _plot_data_query(columns, sql), report_folder_path
+        )
 
         return json.dumps({"status": "success", "message": "Plotting code executed."})
     except Exception as e:
@@ -129,26 +205,61 @@ def write_markdown_report(report_content: str, report_folder_path: str) -> str:
         return json.dumps({"error": f"Failed to write report file: {e}"})
 
 
+# --- Shared Schema Provider ---
+class SchemaProvider:
+    """Formats the database schema once and serves it from memory until the database file changes."""
+
+    def __init__(self, db_path: Path):
+        self._db_path = db_path
+        self._mtime = None
+        self._schema = None
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        """Returns the schema description, rebuilding it if the database has been modified."""
+        mtime = self._db_path.stat().st_mtime_ns
+        with self._lock:
+            if self._mtime != mtime:
+                self._schema = self._build()
+                self._mtime = mtime
+            return self._schema
+
+    def _build(self) -> str:
+        cursor = get_conn(self._db_path).cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
+        tables = cursor.fetchall()
+        if not tables:
+            return "No tables found in the database."
+        schema_info = "The database contains the following tables:\n"
+        for (table_name,) in tables:
+            cursor.execute(f"PRAGMA table_info('{table_name}');")
+            columns = [col[1] for col in cursor.fetchall()]
+            schema_info += f"- Table '{table_name}' with columns: ({', '.join(columns)})\n"
+        if any(table_name.startswith("_agg_") for (table_name,) in tables):
+            schema_info += (
+                "Tables prefixed '_agg_' are precomputed summaries of analytics_data: one row per value with its row count in column 'n'. Query them instead of re-running GROUP BY ... COUNT(*).\n"
+            )
+        return schema_info
+
+
+SCHEMA_PROVIDER = SchemaProvider(DB_PATH)
+SCHEMA_PROVIDER.get()
+
+
 # --- V4 Agent Definition ---
+REPORT_INSTRUCTION = """You are an elite research analyst AI. Your purpose is to create comprehensive, multi-part reports in Markdown format by planning and executing a sequence of data retrieval and visualization steps.
 
-root_agent = LlmAgent(
-    name="ReportGenerationAssistant",
-    model=os.getenv("AGENT_MODEL", "gemini-1.5-pro-001"),
-    tools=[
-        FunctionTool(func=create_report_folder),
-        FunctionTool(func=execute_sql_query),
-        FunctionTool(func=execute_plotting_code),
-        FunctionTool(func=write_markdown_report),
-    ],
-    instruction="""You are an elite research analyst AI. Your purpose is to create comprehensive, multi-part reports in Markdown format by planning and executing a sequence of data retrieval and visualization steps.
+    The database schema (tables and columns) is listed under **DATABASE SCHEMA** at the end of these instructions. Use it directly when writing SQL and plotting code.
 
     **YOUR METHODICAL PROCESS:**
 
     1.  **ACKNOWLEDGE AND PLAN:** When the user asks for a report, acknowledge the request. Then, formulate a step-by-step plan in your thoughts. Your absolute first action in the plan MUST be to call `create_report_folder` to create a workspace.
 
     2.  **EXECUTE THE PLAN STEP-BY-STEP:** Execute your plan by calling one tool at a time.
-        - Use `execute_sql_query` to get data tables.
+        - Use `execute_sql_query` to get data tables. When the report needs several independent tables, fetch them in one step with `execute_sql_batch(sql_queries=[...])`, which runs them concurrently and returns a JSON list of results in the same order.
         - Use `execute_plotting_code` to generate and save charts. **You must tell the tool where to save the chart by passing the `report_folder_path`**. You must also invent a unique filename for each plot (e.g., `country_breakdown.png`).
+        - The plotting data is available as a pandas DataFrame named `df`. **Always pass `columns`** with the exact list of columns your plotting code uses (e.g. `columns=['Country', 'Division']`), so only that data is loaded. For pre-aggregated data, pass a SQLite `sql` query instead; `df` will hold its result.
+        - Save charts straight to disk (never base64-encode them). The folder is available to your code as the variable `report_folder_path`. Prefer Plotly Express (`px`, pre-loaded) for bar, count, line and pie charts and save them with `fig.write_image(f'{report_folder_path}/<filename>.png', width=1200, height=800)`. Use Matplotlib/Seaborn (`plt`, `sns`) only for charts Plotly Express cannot produce: draw on the pre-created figure `mpl_fig` (`ax = mpl_fig.add_subplot(111)`, pass `ax=ax` to Seaborn) and save with `mpl_fig.savefig(...)`; do not call `plt.figure()` or `plt.close()`.
         - **Crucially, after each tool call, you must remember the result (the data, or the path to the chart) to assemble the final report.**
 
     3.  **ASSEMBLE THE REPORT:** Once all data is gathered and all charts are created, formulate a complete Markdown string for the final report. This string should include titles, summaries of the data, and embedded images using **relative paths** to the filenames you chose (e.g., `![Employee Distribution by Country](country_breakdown.png)`).
@@ -161,8 +272,26 @@ root_agent = LlmAgent(
     * **USER:** "Create a report on the workforce in France, showing a count of employees and a chart of employees by Division."
     * **AGENT's 1st ACTION:** `create_report_folder()` -> gets back a path like `.../report_123`.
     * **AGENT's 2nd ACTION:** `execute_sql_query(sql_query="SELECT COUNT(*) FROM analytics_data WHERE Country = 'France'")` -> gets back the count.
-    * **AGENT's 3rd ACTION:** `execute_plotting_code(report_folder_path='.../report_123', python_code="...sns.countplot(data=df[df['Country']=='France'], y='Division')... plt.savefig('.../report_123/france_divisions.png') ...")` -> saves the chart.
+    * **AGENT's 3rd ACTION:** `execute_plotting_code(report_folder_path='.../report_123', columns=['Country', 'Division'], python_code="counts = df[df['Country']=='France']['Division'].value_counts().reset_index(); fig = px.bar(counts, x='count', y='Division', orientation='h', template='plotly_white'); fig.write_image('.../report_123/france_divisions.png', width=1200, height=800)")` -> saves the chart.
     * **AGENT's 4th ACTION:** `write_markdown_report(report_folder_path='.../report_12_3', report_content='# Report on French Workforce\\n\\nThe total number of employees is 50.\\n\\nHere is the breakdown by division:\\n\\n![Divisions in France](france_divisions.png)')` -> saves the .md file.
     * **AGENT's FINAL ANSWER (Text):** "I have successfully created the report. It is saved at: C:\\...\\report_123\\report.md"
-    """,
-)
\ No newline at end of file
+    """
+
+
+def _build_instruction(context: ReadonlyContext) -> str:
+    """Appends the cached schema to the instructions, so the model never spends a turn inspecting it."""
+    return f"{REPORT_INSTRUCTION}\n    **DATABASE SCHEMA:**\n{SCHEMA_PROVIDER.get()}"
+
+
+root_agent = LlmAgent(
+    name="ReportGenerationAssistant",
+    model=os.getenv("AGENT_MODEL", "gemini-1.5-pro-001"),
+    tools=[
+        FunctionTool(func=create_report_folder),
+        FunctionTool(func=execute_sql_query),
+        FunctionTool(func=execute_sql_batch),
+        FunctionTool(func=execute_plotting_code),
+        FunctionTool(func=write_markdown_report),
+    ],
+    instruction=_build_instruction,
+)
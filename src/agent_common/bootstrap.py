@@ -0,0 +1,27 @@
+# src/agent_common/bootstrap.py
+
+import os
+import sys
+from functools import lru_cache
+
+import vertexai
+
+
+@lru_cache(maxsize=1)
+def init_vertex() -> None:
+    """Initializes Vertex AI once per process, however many agent modules are loaded."""
+    try:
+        resolved_project = os.getenv("GOOGLE_CLOUD_PROJECT")
+        resolved_location = os.getenv("GOOGLE_CLOUD_LOCATION")
+        if not resolved_project or not resolved_location:
+            sys.exit(
+                "FATAL ERROR: GOOGLE_CLOUD_PROJECT and GOOGLE_CLOUD_LOCATION must be set in your .env file."
+            )
+        vertexai.init(
+            project=resolved_project, location=resolved_location, api_transport="rest"
+        )
+        print(
+            f"Vertex AI initialized for project '{resolved_project}' in location '{resolved_location}'."
+        )
+    except Exception as e:
+        sys.exit(f"Error initializing Vertex AI: {e}")
@@ -0,0 +1,85 @@
+# src/agent_common/database.py
+
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import quote
+
+import pandas as pd
+
+try:
+    import connectorx as cx  # Optional: reads query results straight into Arrow.
+except ImportError:
+    cx = None
+
+
+# --- Persistent Database Connections ---
+def open_db_connection(db_path: Path) -> sqlite3.Connection:
+    """Opens a long-lived, read-only connection to db_path tuned for repeated analytical reads."""
+    conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA cache_size=-65536;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    return conn
+
+
+# One connection per thread and database, so tool calls running concurrently do not contend on a shared handle.
+_DB_LOCAL = threading.local()
+
+
+def get_conn(db_path: Path) -> sqlite3.Connection:
+    """Returns the calling thread's connection to db_path, opening it on first use."""
+    # A forked worker inherits the parent's handles; SQLite connections must not cross a fork.
+    if getattr(_DB_LOCAL, "pid", None) != os.getpid():
+        _DB_LOCAL.conns = {}
+        _DB_LOCAL.pid = os.getpid()
+    conn = _DB_LOCAL.conns.get(db_path)
+    if conn is None:
+        conn = _DB_LOCAL.conns[db_path] = open_db_connection(db_path)
+    return conn
+
+
+# --- Query Execution ---
+@lru_cache(maxsize=None)
+def _cx_uri(db_path: Path) -> str:
+    """Returns the connectorx connection string for db_path."""
+    return "sqlite://" + quote(db_path.resolve().as_posix())
+
+
+def _read_arrow(db_path: Path, sql_query: str):
+    """Reads a query result as an Arrow table with connectorx; None if it is not installed or rejects the query."""
+    if cx is None:
+        return None
+    try:
+        return cx.read_sql(_cx_uri(db_path), sql_query, return_type="arrow")
+    except Exception:
+        return None  # connectorx rejects some statements; let sqlite3 run them (and report real errors).
+
+
+def read_sql_frame(db_path: Path, sql_query: str) -> pd.DataFrame:
+    """Reads a query result into a DataFrame, decoding it through Arrow with connectorx when available."""
+    table = _read_arrow(db_path, sql_query)
+    if table is not None:
+        return table.to_pandas()
+    return pd.read_sql_query(sql_query, get_conn(db_path))
+
+
+def query_to_json(db_path: Path, sql_query: str, frame_to_json, scalar_to_json) -> str:
+    """
+    Runs a query and serializes its result with the agent's own layout: frame_to_json(df) for
+    tables, scalar_to_json(column, value) for single values, which skip DataFrame construction.
+    """
+    table = _read_arrow(db_path, sql_query)
+    if table is not None:
+        if table.num_rows == 1 and table.num_columns == 1:
+            return scalar_to_json(table.column_names[0], table.column(0)[0].as_py())
+        return frame_to_json(table.to_pandas())
+    cursor = get_conn(db_path).execute(sql_query)
+    columns = [col[0] for col in cursor.description or ()]
+    rows = cursor.fetchmany(2)
+    if len(rows) == 1 and len(columns) == 1:
+        return scalar_to_json(columns[0], rows[0][0])
+    rows += cursor.fetchall()
+    return frame_to_json(pd.DataFrame.from_records(rows, columns=columns))
@@ -0,0 +1,32 @@
+# src/agent_common/figures.py
+
+import matplotlib
+
+matplotlib.use("Agg")  # non-GUI backend
+import matplotlib.font_manager
+import matplotlib.pyplot as plt
+
+FIGSIZE = (12, 8)
+
+# Creating a Figure (and the first font lookup) costs tens of milliseconds, so one Figure is
+# kept alive and cleared per plot. Both are set up on import, so each plotting worker pays for
+# them once, when it starts.
+matplotlib.font_manager.findfont("DejaVu Sans")
+_FIG = {"figure": plt.figure(figsize=FIGSIZE)}
+
+
+def shared_figure():
+    """Returns the cleared shared Figure, recreating it if plotting code closed it."""
+    fig = _FIG["figure"]
+    if not plt.fignum_exists(fig.number):
+        fig = _FIG["figure"] = plt.figure(figsize=FIGSIZE)
+    fig.clear()
+    plt.figure(fig.number)  # make it current, so plain plt.* calls draw on it too
+    return fig
+
+
+def close_other_figures() -> None:
+    """Closes every figure except the shared one, e.g. figures opened by plotting code."""
+    for fignum in plt.get_fignums():
+        if fignum != _FIG["figure"].number:
+            plt.close(fignum)
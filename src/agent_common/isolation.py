@@ -0,0 +1,101 @@
+# src/agent_common/isolation.py
+
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Workers are started from a fresh interpreter rather than forked from the agent: the ADK server
+# is multithreaded, and a forked child inherits any lock another thread happens to hold.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _start_worker(pid_queue, initializer) -> None:
+    """Worker initializer: reports the worker's pid, so the pool can stop it, then runs `initializer`."""
+    pid_queue.put(os.getpid())
+    if initializer is not None:
+        initializer()
+
+
+def _call(func, args: tuple):
+    """
+    Runs func(*args) in a worker. SystemExit and KeyboardInterrupt raised by generated code would be
+    re-raised in the agent process by the pool, so they are turned into a plain RuntimeError here.
+    """
+    try:
+        return func(*args)
+    except Exception:
+        raise
+    except BaseException as e:
+        raise RuntimeError(f"Code raised {type(e).__name__}: {e}") from None
+
+
+class WorkerPool:
+    """
+    Runs generated code in worker processes, so a crash cannot take the agent down and concurrent
+    calls are not serialized by the GIL. Workers are started on first use and import the calling
+    agent's module, so module-level data (e.g. the CSV agent's DataFrame) is loaded once per worker.
+    """
+
+    def __init__(self, max_workers: int, timeout: float, initializer=None):
+        """
+        Args:
+            max_workers (int): Number of worker processes.
+            timeout (float): Seconds to wait for a call's result.
+            initializer (callable): Run once in each worker before its first task.
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._initializer = initializer
+        self._executor = None
+        self._pid_queue = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> tuple:
+        """Returns the process pool and the queue its workers report their pids on."""
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(START_METHOD)
+                self._pid_queue = context.SimpleQueue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_start_worker,
+                    initargs=(self._pid_queue, self._initializer),
+                )
+            return self._executor, self._pid_queue
+
+    def run(self, func, *args):
+        """
+        Runs func(*args) in a worker process and waits at most `timeout` seconds for the result.
+        Raises TimeoutError when the call runs longer; its worker is stopped.
+        """
+        executor, pid_queue = self._get_executor()
+        try:
+            return executor.submit(_call, func, args).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The call keeps running (and holding its worker) after the wait ends, so the pool is
+            # torn down; calls still in flight on it fail with BrokenProcessPool.
+            self._discard(executor, pid_queue)
+            raise TimeoutError(f"Execution timed out after {self.timeout} s and was stopped.") from None
+        except BrokenProcessPool:
+            self._discard(executor)  # a worker died
+            raise
+
+    def _discard(self, executor: ProcessPoolExecutor, pid_queue=None) -> None:
+        """
+        Drops `executor`, so the next call starts a fresh pool. With `pid_queue`, its workers are
+        killed first, since shutdown() alone waits for a running call to finish.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if pid_queue is not None:
+            while not pid_queue.empty():
+                try:
+                    os.kill(pid_queue.get(), signal.SIGTERM)
+                except OSError:
+                    pass  # already exited
+        executor.shutdown(wait=False, cancel_futures=True)
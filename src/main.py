@@ -1,25 +1,281 @@
 # src/main.py
 
 import sqlite3
+import csv
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from preprocessing.cleaner import CSVCleaner
 
+try:
+    import adbc_driver_sqlite.dbapi as adbc_sqlite  # Optional: ingests Arrow columns without per-row tuples.
+except ImportError:
+    adbc_sqlite = None
+
+# Declared column types, keyed by final (renamed) column names: only these columns are read,
+# and their types are not inferred. NOTE: You must customize this with your actual column
+# names. Names missing from the file are ignored; if none match, every column is read.
+DTYPES = {
+    'new_column_1': 'int32',
+    'new_column_2': 'category',
+}
+USECOLS = list(DTYPES)
+# Formats tried, in order, when the CSV reader infers timestamp columns (plain ISO dates are
+# read as dates regardless). ISO8601 comes first so 'T'-separated and fractional-second values
+# still parse. Parsing at read time avoids converting text in the cleaner.
+TIMESTAMP_FORMATS = [pacsv.ISO8601, '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+# Natural primary key of the data, if it has one. The table is then created WITHOUT ROWID,
+# clustered on this column (values must be unique). Ignored if the column is not loaded.
+PRIMARY_KEY = None
+# Larger pages mean fewer B-tree splits during bulk inserts and fewer reads for table scans.
+PAGE_SIZE = 8192
+
 def get_project_root() -> Path:
     """Returns the project root folder."""
     return Path(__file__).parent.parent
 
-def main():
+def estimate_block_size(csv_path: Path, rows_per_block: int, sample_bytes: int = 1 << 20) -> int:
+    """Estimates the Arrow block size (in bytes) that holds roughly `rows_per_block` rows."""
+    with open(csv_path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    avg_row_bytes = len(sample) / max(sample.count(b'\n'), 1)
+    return max(int(avg_row_bytes * rows_per_block), 1 << 20)
+
+def read_with_pandas(source, column_names: list, dtypes: dict, **kwargs):
+    """Reads headerless CSV data with pandas, which infers column types chunk by chunk."""
+    return pd.read_csv(
+        source, header=None, names=column_names, usecols=list(dtypes) or None, dtype=dtypes or None, **kwargs
+    )
+
+def iter_csv_chunks(csv_path: Path, read_options, convert_options, dtypes: dict, chunk_size: int):
+    """
+    Yields the CSV as DataFrame chunks from Arrow's streaming reader. Arrow fixes each undeclared
+    column's type from the first block, so if a later block does not fit (e.g. a decimal in an
+    integer column), the rest of the file is read with pandas instead of abandoning the load.
+    """
+    rows_read = 0
+    try:
+        # Arrow tokenizes each block on a thread pool; blocks are sized to hold ~CHUNK_SIZE rows.
+        for batch in pacsv.open_csv(csv_path, read_options=read_options, convert_options=convert_options):
+            rows_read += batch.num_rows
+            yield batch.to_pandas()
+        return
+    except pa.ArrowInvalid as e:
+        print(f"Warning: Arrow could not convert the CSV after {rows_read} rows; reading the rest with pandas: {e}")
+    yield from read_with_pandas(
+        csv_path, read_options.column_names, dtypes, skiprows=rows_read + 1, chunksize=chunk_size
+    )
+
+def format_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns `df` with its date and datetime columns as text in the layout to_sql stores
+    ('%Y-%m-%d' and '%Y-%m-%d %H:%M:%S', with '.%f' on values that have microseconds),
+    so every insert path writes the same values.
+    """
+    formatted = {}
+    for name, col in df.items():
+        if isinstance(col.dtype, pd.ArrowDtype) and pa.types.is_date(col.dtype.pyarrow_dtype):
+            formatted[name] = col.dt.strftime('%Y-%m-%d')
+        elif pd.api.types.is_datetime64_any_dtype(col):
+            text = col.dt.strftime('%Y-%m-%d %H:%M:%S')
+            subsecond = col.dt.microsecond != 0
+            if subsecond.any():
+                text = text.mask(subsecond, col.dt.strftime('%Y-%m-%d %H:%M:%S.%f'))
+            formatted[name] = text
+    return df.assign(**formatted) if formatted else df
+
+def iter_rows(df: pd.DataFrame):
+    """Yields the DataFrame's rows as tuples of values sqlite3 can bind, converting column by column."""
+    columns = []
+    for _, col in format_timestamps(df).items():
+        if isinstance(col.dtype, np.dtype) and col.dtype.kind in 'biuf':
+            columns.append(col.tolist())  # NaN binds as NULL
+        else:
+            # Object and extension columns (e.g. string[pyarrow] from the cleaner) become Python objects
+            # only here, at the bind; they may hold NaN, NaT or pd.NA, none of which sqlite3 can bind.
+            columns.append(col.astype(object).where(col.notna(), None).tolist())
+    return zip(*columns)
+
+def fits_in_memory(path: Path) -> bool:
+    """Returns True if the file is smaller than the currently available physical memory."""
+    try:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return False  # Unknown on this platform; stay on the chunked path.
+    return path.stat().st_size < available
+
+def clean_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Runs the cleaning steps on one chunk."""
+    return CSVCleaner(chunk).clean_data()
+
+def clean_ahead(chunks, executor: ThreadPoolExecutor, depth: int = 2):
+    """Yields cleaned chunks in order while up to `depth` upcoming chunks are cleaned on the executor."""
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(clean_chunk, chunk))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def final_column_names(csv_path: Path) -> list:
+    """Reads the CSV header once and applies CSVCleaner.COLUMN_MAPPING to it."""
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:  # drops a UTF-8 BOM, as pandas does
+        header = next(csv.reader(f), [])
+    return [CSVCleaner.COLUMN_MAPPING.get(col, col) for col in header]
+
+def declared_columns(column_names: list) -> dict:
+    """Returns the DTYPES entries whose columns exist among the file's (renamed) columns."""
+    dtypes = {col: DTYPES[col] for col in USECOLS if col in column_names}
+    if not dtypes:
+        print("No DTYPES columns found in the CSV header; reading all columns.")
+    return dtypes
+
+def to_arrow_type(dtype: str) -> pa.DataType:
+    """Maps a pandas dtype name from DTYPES to the Arrow type the CSV reader should produce."""
+    if dtype == 'category':
+        return pa.dictionary(pa.int32(), pa.string())
+    if dtype in ('str', 'string', 'object'):
+        return pa.string()
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+def parquet_cache_is_fresh(cache_path: Path, *sources: Path) -> bool:
+    """Returns True if the cache exists and is newer than every file it was derived from."""
+    if not cache_path.exists():
+        return False
+    cache_mtime = cache_path.stat().st_mtime
+    return all(cache_mtime > source.stat().st_mtime for source in sources)
+
+def append_to_parquet(writer, df: pd.DataFrame, path: Path):
+    """Appends a cleaned chunk to the Parquet cache, opening the writer on the first chunk."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if writer is None:
+        # The cleaner downcasts each chunk to the narrowest type its own values need, which can
+        # differ between chunks, so the file stores every integer as int64 and float as float64.
+        schema = pa.schema([
+            field.with_type(pa.int64()) if pa.types.is_integer(field.type)
+            else field.with_type(pa.float64()) if pa.types.is_floating(field.type)
+            else field
+            for field in table.schema
+        ], metadata=table.schema.metadata)
+        writer = pq.ParquetWriter(path, schema, compression='snappy')
+    writer.write_table(table.cast(writer.schema))
+    return writer
+
+def create_table(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame):
+    """(Re)creates the table with columns typed after `df`, clustered on PRIMARY_KEY when it is present."""
+    key = PRIMARY_KEY if PRIMARY_KEY in df.columns else None
+    create_sql = pd.io.sql.get_schema(df.head(0), table_name, keys=key, con=conn)
+    if key is not None:
+        create_sql += " WITHOUT ROWID"
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}";')
+    conn.execute(create_sql)
+
+def quote_identifier(name: str) -> str:
+    """Quotes a column or table name for use in SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+def insert_statement(table_name: str, columns) -> str:
+    """
+    Builds the parameterized INSERT for a table with the given columns. The columns are named
+    explicitly, so rows bind by name order rather than by the table's declared order.
+    """
+    placeholders = ', '.join('?' * len(columns))
+    target_columns = ', '.join(quote_identifier(col) for col in columns)
+    return f"INSERT INTO {quote_identifier(table_name)} ({target_columns}) VALUES ({placeholders})"
+
+def csv_source_median(conn: sqlite3.Connection, column: str):
+    """Returns the median of a numeric column of temp.csv_source (empty fields are skipped)."""
+    value = f"CAST({quote_identifier(column)} AS REAL)"
+    present = f"NULLIF({quote_identifier(column)}, '') IS NOT NULL"
+    return conn.execute(
+        f"SELECT AVG(v) FROM (SELECT {value} AS v FROM temp.csv_source WHERE {present} ORDER BY v "
+        f"LIMIT 2 - (SELECT COUNT(*) FROM temp.csv_source WHERE {present}) % 2 "
+        f"OFFSET (SELECT (COUNT(*) - 1) / 2 FROM temp.csv_source WHERE {present}))"
+    ).fetchone()[0]
+
+def load_via_csv_extension(conn: sqlite3.Connection, csv_path: Path, table_name: str, extension_path: str):
+    """
+    Loads the CSV with one INSERT ... SELECT from SQLite's `csv` virtual table, so parsing,
+    renaming, missing-value fills and inserts all run inside SQLite.
+
+    Args:
+        conn (sqlite3.Connection): The target database connection.
+        csv_path (Path): The CSV file to load.
+        table_name (str): The table to (re)create and fill.
+        extension_path (str): Path to a compiled build of SQLite's `csv` extension.
+    """
+    if not hasattr(conn, 'enable_load_extension'):
+        raise RuntimeError("This Python's sqlite3 module was built without extension loading support.")
+    conn.enable_load_extension(True)
+    try:
+        conn.load_extension(extension_path)
+    finally:
+        conn.enable_load_extension(False)
+    filename = str(csv_path).replace("'", "''")
+    conn.execute("DROP TABLE IF EXISTS temp.csv_source;")
+    conn.execute(f"CREATE VIRTUAL TABLE temp.csv_source USING csv(filename='{filename}', header=YES);")
+    insert_from_csv_source(conn, csv_path, table_name)
+    conn.execute("DROP TABLE temp.csv_source;")
+
+def insert_from_csv_source(conn: sqlite3.Connection, csv_path: Path, table_name: str):
+    """Creates the table and fills it from temp.csv_source, applying the cleaner's rules in SQL."""
+    # Column types come from a cleaned sample, so the table matches the one the chunked path creates;
+    # column affinity then converts the virtual table's text values on insert.
+    column_names = final_column_names(csv_path)
+    source_columns = dict(zip(column_names, pd.read_csv(csv_path, nrows=0).columns))
+    dtypes = declared_columns(column_names)
+    sample = pd.read_csv(csv_path, nrows=1000, header=0, names=column_names, usecols=list(dtypes) or None)
+    sample = CSVCleaner(sample).clean_data()
+    create_table(conn, table_name, sample)
+
+    select_exprs, params = [], []
+    for col in sample.columns:
+        expr = f"NULLIF({quote_identifier(source_columns[col])}, '')"
+        if col in CSVCleaner.NUMERIC_COLUMNS:
+            expr = f"COALESCE({expr}, ?)"
+            params.append(csv_source_median(conn, source_columns[col]))
+        elif col in CSVCleaner.CATEGORICAL_COLUMNS:
+            expr = f"COALESCE({expr}, 'Unknown')"
+        select_exprs.append(expr)
+    target_columns = ', '.join(quote_identifier(col) for col in sample.columns)
+    conn.execute("BEGIN")
+    conn.execute(
+        f"INSERT INTO {quote_identifier(table_name)} ({target_columns}) "
+        f"SELECT {', '.join(select_exprs)} FROM temp.csv_source",
+        params,
+    )
+    conn.commit()
+
+def main(fast_io: bool = False, csv_extension: str = None):
     """
     Main function to run the data processing pipeline.
+
+    Args:
+        fast_io (bool): Read the whole CSV at once with the pyarrow engine when it fits in memory.
+        csv_extension (str): Path to SQLite's `csv` extension; when given, SQLite loads the file itself.
     """
     # --- Configuration ---
     ROOT_DIR = get_project_root()
     INPUT_CSV_PATH = ROOT_DIR / 'data' / 'raw' / 'data.csv'
     DB_OUTPUT_PATH = ROOT_DIR / 'data' / 'processed' / 'analytics.db'
+    # Cleaned rows from the last run; reused while it is newer than the CSV, the cleaner and DTYPES.
+    PARQUET_CACHE_PATH = ROOT_DIR / 'data' / 'processed' / 'data.parquet'
+    CLEANER_PATH = Path(__file__).parent / 'preprocessing' / 'cleaner.py'
     
     TABLE_NAME = 'analytics_data'
     CHUNK_SIZE = 100000  
+    # Columns the agents filter and group on most; indexed after loading (skipped if absent).
+    INDEXED_COLUMNS = ['Country', 'Division']
+    # Columns whose per-value row counts are precomputed into '_agg_<column>' summary tables.
+    SUMMARY_COLUMNS = ['Country', 'Division']
 
     # --- Ensure output directory exists ---
     DB_OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -27,26 +283,124 @@ def main():
     # --- Database Setup ---
     try:
         conn = sqlite3.connect(DB_OUTPUT_PATH)
+        # page_size only takes effect on an empty database or after a VACUUM, so an existing
+        # file is rebuilt once when its page size differs (the file is in rollback mode here).
+        conn.execute(f"PRAGMA page_size={PAGE_SIZE};")
+        if conn.execute("PRAGMA page_size;").fetchone()[0] != PAGE_SIZE:
+            conn.execute("VACUUM;")
+        # Bulk-load settings: WAL with relaxed syncing, large page cache, temp data in memory.
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute("PRAGMA cache_size=-200000;")
+        conn.execute("PRAGMA mmap_size=30000000000;")
         print(f"Successfully connected to SQLite database: {DB_OUTPUT_PATH}")
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
         return
 
     # --- Process the CSV in Chunks ---
+    # CSVCleaner no longer copies its chunk; copy-on-write keeps that safe (always on from pandas 3).
+    if int(pd.__version__.split('.')[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
     print(f"Starting the processing of {INPUT_CSV_PATH.name}...")
     first_chunk = True
+    cache_writer = None
+    ingest_conn = None
+    tmp_cache_path = PARQUET_CACHE_PATH.with_suffix('.parquet.tmp')
     try:
-        for chunk in pd.read_csv(INPUT_CSV_PATH, chunksize=CHUNK_SIZE):
-            # Preprocess the Chunk
-            cleaner = CSVCleaner(chunk)
-            cleaned_df = cleaner.clean_data()
-
-            # Load to SQLite
-            if_exists_strategy = 'replace' if first_chunk else 'append'
-            cleaned_df.to_sql(TABLE_NAME, conn, if_exists=if_exists_strategy, index=False)
-            
-            print(f"Processed and loaded a chunk into '{TABLE_NAME}'.")
-            first_chunk = False
+        if csv_extension:
+            # Opt-in: no Parquet cache, no Python-side chunks; cleaning rules are applied in SQL.
+            print(f"Loading {INPUT_CSV_PATH.name} through SQLite's csv extension...")
+            load_via_csv_extension(conn, INPUT_CSV_PATH, TABLE_NAME, csv_extension)
+        else:
+            use_cache = parquet_cache_is_fresh(
+                PARQUET_CACHE_PATH, INPUT_CSV_PATH, CLEANER_PATH, Path(__file__)
+            )
+            write_cache = not use_cache
+            # Columns are renamed at read time, so every chunk arrives with its final names.
+            column_names = [] if use_cache else final_column_names(INPUT_CSV_PATH)
+            dtypes = {} if use_cache else declared_columns(column_names)
+            read_options = pacsv.ReadOptions(
+                block_size=estimate_block_size(INPUT_CSV_PATH, CHUNK_SIZE),
+                use_threads=True,
+                column_names=column_names,
+                skip_rows=1,
+            )
+            convert_options = pacsv.ConvertOptions(
+                include_columns=list(dtypes),
+                column_types={col: to_arrow_type(dtype) for col, dtype in dtypes.items()},
+                timestamp_parsers=TIMESTAMP_FORMATS,
+                strings_can_be_null=True,  # empty text fields load as NULL, as with pd.read_csv
+            )
+            if use_cache:
+                print(f"Using cleaned data cached at {PARQUET_CACHE_PATH}")
+            elif fast_io and fits_in_memory(INPUT_CSV_PATH):
+                # One-shot mode: a single Arrow-backed frame (what pd.read_csv(engine="pyarrow",
+                # dtype_backend="pyarrow") produces), loaded as one "chunk".
+                print("Fast I/O enabled: reading the whole file in one pass.")
+                try:
+                    table = pacsv.read_csv(
+                        INPUT_CSV_PATH, read_options=read_options, convert_options=convert_options
+                    )
+                    chunks = [table.to_pandas(types_mapper=pd.ArrowDtype)]
+                except pa.ArrowInvalid as e:
+                    print(f"Warning: Arrow could not convert the CSV in one pass; streaming it instead: {e}")
+                    chunks = iter_csv_chunks(INPUT_CSV_PATH, read_options, convert_options, dtypes, CHUNK_SIZE)
+            else:
+                chunks = iter_csv_chunks(INPUT_CSV_PATH, read_options, convert_options, dtypes, CHUNK_SIZE)
+            # Preprocess the Chunks on worker threads, so the next chunks are cleaned while
+            # the main thread inserts the current one. Cached chunks are already clean.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                if use_cache:
+                    cleaned_chunks = (
+                        batch.to_pandas()
+                        for batch in pq.ParquetFile(PARQUET_CACHE_PATH).iter_batches(batch_size=CHUNK_SIZE)
+                    )
+                else:
+                    cleaned_chunks = clean_ahead(chunks, executor)
+                for cleaned_df in cleaned_chunks:
+                    if write_cache:
+                        try:
+                            cache_writer = append_to_parquet(cache_writer, cleaned_df, tmp_cache_path)
+                        except (pa.ArrowException, ValueError) as e:
+                            print(f"Warning: not caching this run as Parquet: {e}")
+                            write_cache = False
+                    # Load to SQLite: create the table from the first chunk, then insert every chunk
+                    # inside a single transaction instead of committing per chunk. With ADBC the
+                    # chunk goes in as Arrow columns; otherwise as row tuples through executemany.
+                    if first_chunk:
+                        create_table(conn, TABLE_NAME, cleaned_df)
+                        if adbc_sqlite is not None:
+                            conn.commit()  # release the schema change before the ADBC connection writes
+                            ingest_conn = adbc_sqlite.connect(str(DB_OUTPUT_PATH))
+                            ingest_cursor = ingest_conn.cursor()
+                        else:
+                            # Generated once per run; passing the same string to every executemany
+                            # lets sqlite3's statement cache reuse one prepared statement.
+                            insert_sql = insert_statement(TABLE_NAME, cleaned_df.columns)
+                            conn.execute("BEGIN")
+                    if ingest_conn is not None:
+                        # ADBC would store timestamps as ISO text with a 'T' and microseconds.
+                        ingest_cursor.adbc_ingest(
+                            TABLE_NAME,
+                            pa.Table.from_pandas(format_timestamps(cleaned_df), preserve_index=False),
+                            mode='append',
+                        )
+                    else:
+                        conn.executemany(insert_sql, iter_rows(cleaned_df))
+                
+                    print(f"Processed and loaded a chunk into '{TABLE_NAME}'.")
+                    first_chunk = False
+            if ingest_conn is not None:
+                ingest_conn.commit()
+            conn.commit()
+            if cache_writer is not None:
+                cache_writer.close()
+                cache_writer = None
+                if write_cache:
+                    os.replace(tmp_cache_path, PARQUET_CACHE_PATH)
+                    print(f"Cached the cleaned data at {PARQUET_CACHE_PATH}")
 
     except FileNotFoundError:
         print(f"Error: Input file not found at {INPUT_CSV_PATH}")
@@ -55,8 +409,50 @@ def main():
         print(f"An error occurred during processing: {e}")
         return
     finally:
+        if ingest_conn is not None:
+            ingest_conn.close()
+        if cache_writer is not None:
+            cache_writer.close()
+        tmp_cache_path.unlink(missing_ok=True)
         print("\nProcessing complete!")
 
+    # --- Indexing ---
+    print("\nIndexing frequently queried columns...")
+    existing_columns = {row[1] for row in conn.execute(f"PRAGMA table_info('{TABLE_NAME}');")}
+    try:
+        for column in INDEXED_COLUMNS:
+            if column not in existing_columns:
+                print(f"Skipping index on '{column}': column not found.")
+                continue
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "idx_{column.lower()}" ON {TABLE_NAME} ("{column}");'
+            )
+            print(f"Indexed column '{column}'.")
+        # Refresh the planner statistics so SQLite actually picks the new indexes.
+        conn.execute("ANALYZE;")
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"An error occurred while indexing: {e}")
+
+    # --- Summary Tables ---
+    # Rebuilt on every load, so they always match the freshly loaded data.
+    print("\nBuilding summary tables...")
+    try:
+        for column in SUMMARY_COLUMNS:
+            if column not in existing_columns:
+                print(f"Skipping summary of '{column}': column not found.")
+                continue
+            summary_table = f"_agg_{column.lower()}"
+            conn.execute(f"DROP TABLE IF EXISTS {summary_table};")
+            conn.execute(
+                f'CREATE TABLE {summary_table} AS SELECT "{column}", COUNT(*) AS n '
+                f'FROM {TABLE_NAME} GROUP BY "{column}";'
+            )
+            print(f"Built summary table '{summary_table}'.")
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"An error occurred while building summary tables: {e}")
+
     # --- Verification ---
     print("\nVerifying the data in the database...")
     try:
@@ -72,9 +468,24 @@ def main():
         print(f"An error occurred during verification: {e}")
     finally:
         # --- Close Connection ---
+        conn.execute("PRAGMA optimize;")
+        # Leave the file in rollback-journal mode so the agents' read-only connections need no -wal/-shm files.
+        conn.execute("PRAGMA journal_mode=DELETE;")
         conn.close()
         print("\nDatabase connection closed.")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Clean the raw CSV and load it into SQLite.")
+    parser.add_argument(
+        '--fast-io',
+        action='store_true',
+        help="Read the whole CSV at once with the pyarrow engine when it fits in memory.",
+    )
+    parser.add_argument(
+        '--csv-extension',
+        metavar='PATH',
+        help="Path to a compiled SQLite csv extension; SQLite then parses and inserts the file itself.",
+    )
+    args = parser.parse_args()
+    main(fast_io=args.fast_io, csv_extension=args.csv_extension)
\ No newline at end of file
@@ -0,0 +1,26 @@
+# src/preprocessing/kernels.py
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Optional: without Numba the cleaner falls back to pandas operations.
+    njit = None
+
+if njit is not None:
+    # Not parallel=True: the cleaner already runs on worker threads, and Numba's parallel
+    # backend called from several of them keeps the interpreter from exiting.
+    @njit(cache=True)
+    def fill_nan_inplace(values: np.ndarray, fill_value: float):
+        """
+        Replaces the NaNs of a float array with `fill_value`, in place, in a native loop.
+
+        Args:
+            values (np.ndarray): A writable 1-D float array.
+            fill_value (float): The value written over each NaN.
+        """
+        for i in range(values.shape[0]):
+            if np.isnan(values[i]):
+                values[i] = fill_value
+else:
+    fill_nan_inplace = None